@@ -3,24 +3,41 @@ Chokwadi AI - Main Application
 WhatsApp bot via Meta WhatsApp Cloud API.
 Deployed on Railway.
 """
+import atexit
 import os
 import re
 import json
+import logging
+import queue
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 import httpx
-from flask import Flask, request, jsonify
+import orjson
+from flask import Flask, request
 
 from config import (
     WHATSAPP_ACCESS_TOKEN, WHATSAPP_PHONE_NUMBER_ID,
     WHATSAPP_VERIFY_TOKEN, GRAPH_API_VERSION,
-    FLASK_PORT, FLASK_DEBUG, AI_PROVIDER, ADMIN_PHONE,
+    FLASK_PORT, FLASK_DEBUG, AI_PROVIDER, ADMIN_PHONES,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_DRAIN_SECONDS,
     get_active_provider, get_available_providers
 )
 from core.analyzer import analyze_text, analyze_image_with_vision
 from core.transcriber import transcribe_voice_note
 from core.link_scanner import scan_url, format_scan_results
+from core.cache import response_cache, message_dedupe
+from core.log import log
 
 app = Flask(__name__)
 
+_BAR = "=" * 60
+
+
+def _json_response(payload: dict, status: int = 200):
+    """JSON response serialised with orjson instead of Flask's stdlib json."""
+    return app.response_class(orjson.dumps(payload), status=status, mimetype="application/json")
+
 # ─── Runtime provider override ────────────────────────────────────────────
 _runtime_provider_override = None
 
@@ -39,13 +56,47 @@ HEADERS = {
     "Content-Type": "application/json",
 }
 
+# One pooled client for every Graph API call, so sends, read receipts and
+# media lookups reuse keep-alive connections instead of a TLS handshake each
+_HTTP = httpx.Client(
+    headers=HEADERS,
+    timeout=30,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+)
+atexit.register(_HTTP.close)
+
+
+# WhatsApp has a ~4096 char limit per message
+MESSAGE_CHAR_LIMIT = 4000
+_SPLIT_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+
+def _split_message(text: str, limit: int = MESSAGE_CHAR_LIMIT) -> Iterator[str]:
+    """
+    Yield chunks of at most `limit` characters, breaking at the last
+    paragraph, line, sentence or word boundary in each window so words and
+    emoji sequences aren't cut in half. "".join(chunks) == text.
+
+    Boundaries are searched in place by offset, so each character is copied
+    once into its chunk rather than re-slicing the remainder every round.
+    """
+    start, end = 0, len(text)
+    while end - start > limit:
+        stop = start + limit
+        cut = stop
+        for sep in _SPLIT_SEPARATORS:
+            idx = text.rfind(sep, start + limit // 2 + 1, stop)
+            if idx != -1:
+                cut = idx + len(sep)
+                break
+        yield text[start:cut]
+        start = cut
+    yield text[start:]
+
 
 def send_whatsapp_message(to: str, text: str):
     """Send a text message via Meta WhatsApp Cloud API."""
-    # WhatsApp has a ~4096 char limit per message
-    chunks = [text[i:i + 4000] for i in range(0, len(text), 4000)] if len(text) > 4000 else [text]
-
-    for chunk in chunks:
+    for chunk in _split_message(text):
         payload = {
             "messaging_product": "whatsapp",
             "to": to,
@@ -53,12 +104,13 @@ def send_whatsapp_message(to: str, text: str):
             "text": {"body": chunk},
         }
         try:
-            resp = httpx.post(MESSAGES_URL, headers=HEADERS, json=payload, timeout=30)
-            print(f"[SEND] To {to}: {resp.status_code} {resp.text[:200]}")
+            resp = _HTTP.post(MESSAGES_URL, json=payload)
             if resp.status_code != 200:
-                print(f"[SEND ERROR] {resp.text}")
+                log.error("[SEND ERROR] To %s: %s %s", to, resp.status_code, resp.text)
+            else:
+                log.debug("[SEND] To %s: %s", to, resp.status_code)
         except Exception as e:
-            print(f"[SEND ERROR] {e}")
+            log.error("[SEND ERROR] %s", e)
 
 
 def mark_as_read(message_id: str):
@@ -69,11 +121,16 @@ def mark_as_read(message_id: str):
         "message_id": message_id,
     }
     try:
-        httpx.post(MESSAGES_URL, headers=HEADERS, json=payload, timeout=10)
+        _HTTP.post(MESSAGES_URL, json=payload, timeout=10)
     except Exception:
         pass
 
 
+# Read receipts are fire-and-forget, so they go out while the message is
+# already being processed instead of delaying media lookups and AI calls
+_ACK_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ack")
+
+
 # ─── Messages ─────────────────────────────────────────────────────────────
 
 WELCOME_MESSAGE = """🇿🇼 *Mauya ku Chokwadi AI!* 🇿🇼
@@ -104,63 +161,79 @@ Tumira message yako izvozvi! 👇
 🇿🇼 _Chokwadi AI - Chokwadi Chisingaputse ukama_
 """
 
-GREETING_WORDS = {
+GREETING_WORDS = frozenset({
     "hi", "hello", "help", "start", "menu",
     "mauya", "salibonani", "ndeipi", "hey", "heyy", "howzit",
     "maswera sei", "makadii", "kunjani", "yo","hoyo"
-}
+})
+# Anything longer can't be a greeting, so long forwards skip the .lower() copy
+MAX_GREETING_LEN = max(map(len, GREETING_WORDS))
 
 
 # ─── Admin Commands ───────────────────────────────────────────────────────
 
-def _handle_admin_command(command: str) -> str | None:
-    global _runtime_provider_override
-    cmd = command.strip().lower()
+def _cmd_status() -> str:
+    available = get_available_providers()
+    current = _current_provider()
+    override = _runtime_provider_override or "none"
+    return (
+        f"⚙️ *Chokwadi AI Status*\n\n"
+        f"Config provider: {AI_PROVIDER}\n"
+        f"Runtime override: {override}\n"
+        f"Active provider: *{current}*\n"
+        f"Available: {', '.join(available)}"
+    )
 
-    if cmd == "!status":
-        available = get_available_providers()
-        current = _current_provider()
-        override = _runtime_provider_override or "none"
-        return (
-            f"⚙️ *Chokwadi AI Status*\n\n"
-            f"Config provider: {AI_PROVIDER}\n"
-            f"Runtime override: {override}\n"
-            f"Active provider: *{current}*\n"
-            f"Available: {', '.join(available)}"
-        )
-    elif cmd == "!claude":
-        _runtime_provider_override = "anthropic"
-        return "✅ Switched to *Anthropic Claude*"
-    elif cmd == "!gpt":
-        _runtime_provider_override = "openai"
-        return "✅ Switched to *OpenAI GPT*"
-    elif cmd == "!auto":
-        _runtime_provider_override = None
-        return "✅ Switched to *auto mode* (Claude → GPT fallback)"
-    return None
+
+def _set_override(provider: str | None, reply: str):
+    def command() -> str:
+        global _runtime_provider_override
+        _runtime_provider_override = provider
+        return reply
+    return command
+
+
+_ADMIN_COMMANDS = {
+    "!status": _cmd_status,
+    "!claude": _set_override("anthropic", "✅ Switched to *Anthropic Claude*"),
+    "!gpt": _set_override("openai", "✅ Switched to *OpenAI GPT*"),
+    "!auto": _set_override(None, "✅ Switched to *auto mode* (Claude → GPT fallback)"),
+}
+# Commands are short; only this much of a message is normalised, so a long
+# "!..." flood costs no more than a real command
+_ADMIN_COMMAND_MAX_LEN = 16
+
+
+def _handle_admin_command(command: str) -> str | None:
+    handler = _ADMIN_COMMANDS.get(command[:_ADMIN_COMMAND_MAX_LEN].strip().lower())
+    return handler() if handler else None
 
 
 # ─── Content Detection ─────────────────────────────────────────────────────
 
-def detect_message_type(message: dict) -> str:
-    """Detect WhatsApp message type from the webhook payload."""
-    msg_type = message.get("type", "text")
-    if msg_type == "audio":
-        return "voice"
-    elif msg_type == "image":
-        return "image"
-    elif msg_type == "document":
-        return "document"
-    elif msg_type == "text":
-        body = message.get("text", {}).get("body", "")
-        if re.search(r'https?://[^\s<>"{}|\\^`\[\]]+', body):
-            return "link"
-        return "text"
-    return "text"
+URL_RE = re.compile(r'https?://[^\s<>"{}|\\^`\[\]]+')
 
 
-def extract_urls(text: str) -> list:
-    return re.findall(r'https?://[^\s<>"{}|\\^`\[\]]+', text)
+# Meta message "type" -> content handler; text is split into text/link below
+MESSAGE_KINDS = {"audio": "voice", "image": "image", "document": "document"}
+
+
+def detect_message_type(message: dict) -> tuple[str, list]:
+    """
+    Detect WhatsApp message type from the webhook payload.
+
+    Returns (content_type, urls); urls is only non-empty for links, so the
+    link handler reuses this single regex pass instead of scanning again.
+    """
+    msg_type = message.get("type", "text")
+    kind = MESSAGE_KINDS.get(msg_type)
+    if kind:
+        return kind, []
+    if msg_type == "text":
+        urls = URL_RE.findall(message.get("text", {}).get("body", ""))
+        if urls:
+            return "link", urls
+    return "text", []
 
 
 # ─── Webhook ───────────────────────────────────────────────────────────────
@@ -173,40 +246,110 @@ def verify_webhook():
     challenge = request.args.get("hub.challenge")
 
     if mode == "subscribe" and token == WHATSAPP_VERIFY_TOKEN:
-        print(f"[WEBHOOK] Verification successful")
+        log.info("[WEBHOOK] Verification successful")
         return challenge, 200
     else:
-        print(f"[WEBHOOK] Verification failed - token mismatch")
+        log.warning("[WEBHOOK] Verification failed - token mismatch")
         return "Forbidden", 403
 
 
 @app.route("/webhook", methods=["POST"])
 def webhook():
-    """Meta WhatsApp webhook — receives messages, processes, and responds."""
-    body = request.get_json()
+    """Meta WhatsApp webhook — queues messages for processing and ACKs at once."""
+    try:
+        body = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        body = None
 
     if not body:
-        return jsonify({"status": "no body"}), 400
+        return _json_response({"status": "no body"}, 400)
 
-    # Meta sends various webhook events; we only care about messages
     try:
-        entries = body.get("entry", [])
-        for entry in entries:
-            changes = entry.get("changes", [])
-            for change in changes:
-                value = change.get("value", {})
-                messages = value.get("messages", [])
-
-                for message in messages:
-                    _process_message(message)
+        for message in _iter_messages(body):
+            _enqueue_message(message)
 
     except Exception as e:
-        print(f"[ERROR] Webhook processing: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("[ERROR] Webhook processing: %s", e)
 
     # Always return 200 to Meta (otherwise they retry and you get duplicates)
-    return jsonify({"status": "ok"}), 200
+    return _json_response({"status": "ok"})
+
+
+def _iter_messages(body: dict):
+    """
+    Yield entry[].changes[].value.messages[] from a webhook payload in one
+    flat pass. Meta sends various webhook events; we only care about messages.
+    """
+    return (
+        message
+        for entry in body.get("entry", ())
+        for change in entry.get("changes", ())
+        for message in change.get("value", {}).get("messages", ())
+    )
+
+
+# ─── Background Workers ────────────────────────────────────────────────────
+
+_WORK_Q = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+
+# Queued + in-flight messages, tracked here rather than via Queue internals,
+# which gevent's patched Queue doesn't have; _IDLE is set whenever it is 0
+_pending = 0
+_PENDING_LOCK = threading.Lock()
+_IDLE = threading.Event()
+_IDLE.set()
+
+
+def _track_pending(delta: int):
+    global _pending
+    with _PENDING_LOCK:
+        _pending += delta
+        if _pending:
+            _IDLE.clear()
+        else:
+            _IDLE.set()
+
+def _enqueue_message(message: dict):
+    if message_dedupe.seen_before(message.get("id", "")):
+        log.info("[DEDUPE] Skipping redelivered message %s", message.get("id"))
+        return
+
+    _track_pending(1)  # before the put, so a fast worker can't finish first
+    try:
+        _WORK_Q.put_nowait(message)
+    except queue.Full:
+        _track_pending(-1)
+        # Backpressure: handle it on the request rather than drop it
+        log.warning("[QUEUE] Full (%d), processing inline", WEBHOOK_QUEUE_SIZE)
+        _process_message(message)
+
+
+def _worker():
+    while True:
+        message = _WORK_Q.get()
+        try:
+            _process_message(message)
+        except Exception as e:
+            log.exception("[ERROR] Worker: %s", e)
+        finally:
+            _track_pending(-1)
+
+
+for _i in range(WEBHOOK_WORKERS):
+    threading.Thread(target=_worker, name=f"webhook-worker-{_i}", daemon=True).start()
+
+
+def drain_work_queue(timeout: float = WEBHOOK_DRAIN_SECONDS) -> bool:
+    """
+    Wait until every queued and in-flight message has been handled, or until
+    `timeout` seconds pass. Called from gunicorn's worker_exit hook (see
+    gunicorn.conf.py), before interpreter shutdown stops the thread pools
+    the handlers rely on; the daemon worker threads die with the process.
+    """
+    if _IDLE.wait(timeout):
+        return True
+    log.warning("[QUEUE] Shutdown with %d message(s) unprocessed", _pending)
+    return False
 
 
 def _process_message(message: dict):
@@ -220,30 +363,34 @@ def _process_message(message: dict):
     if msg_type == "text":
         text_body = message.get("text", {}).get("body", "").strip()
 
-    print(f"\n{'='*60}")
-    print(f"[IN] From: {sender}")
-    print(f"[IN] Type: {msg_type}")
-    print(f"[IN] Body: {text_body[:120]}")
-    print(f"[IN] Provider: {_current_provider()}")
-    print(f"{'='*60}")
+    # --- Greetings: single canned reply, skip the banner and content routing ---
+    if msg_type == "text" and len(text_body) <= MAX_GREETING_LEN \
+            and text_body.lower() in GREETING_WORDS:
+        log.info("[IN] Greeting from %s", sender)
+        _ACK_POOL.submit(mark_as_read, message_id)
+        send_whatsapp_message(sender, WELCOME_MESSAGE)
+        return
 
-    # Mark as read (blue ticks)
-    mark_as_read(message_id)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(
+            "\n%s\n[IN] From: %s\n[IN] Type: %s\n[IN] Body: %s\n[IN] Provider: %s\n%s",
+            _BAR, sender, msg_type, text_body[:120], _current_provider(), _BAR,
+        )
+    else:
+        log.info("[IN] %s from %s", msg_type, sender)
+
+    # Mark as read (blue ticks), overlapping with the work below
+    _ACK_POOL.submit(mark_as_read, message_id)
 
     # --- Admin commands ---
-    if sender == ADMIN_PHONE and text_body.startswith("!"):
+    if ADMIN_PHONES and sender in ADMIN_PHONES and text_body.startswith("!"):
         admin_resp = _handle_admin_command(text_body)
         if admin_resp:
             send_whatsapp_message(sender, admin_resp)
             return
 
-    # --- Greetings ---
-    if msg_type == "text" and text_body.lower() in GREETING_WORDS:
-        send_whatsapp_message(sender, WELCOME_MESSAGE)
-        return
-
     # --- Process by content type ---
-    content_type = detect_message_type(message)
+    content_type, urls = detect_message_type(message)
 
     try:
         if content_type == "voice":
@@ -255,7 +402,7 @@ def _process_message(message: dict):
             response_text = _handle_image(media_id, sender)
 
         elif content_type == "link":
-            response_text = _handle_link(text_body, sender)
+            response_text = _handle_link(text_body, urls, sender)
 
         else:
             response_text = _handle_text(text_body, sender)
@@ -263,9 +410,7 @@ def _process_message(message: dict):
         send_whatsapp_message(sender, response_text)
 
     except Exception as e:
-        print(f"[ERROR] {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("[ERROR] %s", e)
         send_whatsapp_message(
             sender,
             "⚠️ Pane dambudziko rekutarisa content iyi. "
@@ -283,12 +428,12 @@ def _handle_text(message: str, sender: str) -> str:
             "(Please send a longer message for me to analyse.)\n\n"
             "Tumira 'help' kuti uwane rubatsiro. (Send 'help' for assistance.)"
         )
-    print(f"[PROCESS] Text analysis for {sender}")
+    log.info("[PROCESS] Text analysis for %s", sender)
     return analyze_text(message, content_type="text")
 
 
 def _handle_voice(media_id: str, sender: str) -> str:
-    print(f"[PROCESS] Voice note for {sender}")
+    log.info("[PROCESS] Voice note for %s", sender)
 
     if not media_id:
         return (
@@ -299,7 +444,7 @@ def _handle_voice(media_id: str, sender: str) -> str:
     result = transcribe_voice_note(media_id)
 
     if result.get("text"):
-        print(f"[TRANSCRIBED] Lang: {result['language']} | Text: {result['text'][:150]}...")
+        log.debug("[TRANSCRIBED] Lang: %s | Text: %s...", result["language"], result["text"][:150])
         analysis = analyze_text(result["text"], content_type="voice")
         return (
             f"🎤 *Voice Note Transcription:*\n"
@@ -314,7 +459,7 @@ def _handle_voice(media_id: str, sender: str) -> str:
 
 
 def _handle_image(media_id: str, sender: str) -> str:
-    print(f"[PROCESS] Image analysis for {sender}")
+    log.info("[PROCESS] Image analysis for %s", sender)
 
     if not media_id:
         return (
@@ -324,17 +469,15 @@ def _handle_image(media_id: str, sender: str) -> str:
 
     # Get the media URL from Meta, then pass to vision analyzer
     try:
-        media_url_endpoint = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{media_id}"
-        headers = {"Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}"}
-        resp = httpx.get(media_url_endpoint, headers=headers, timeout=30)
-        resp.raise_for_status()
-        media_url = resp.json().get("url")
+        media_url, media_hash = _media_info(media_id)
 
         if media_url:
             # Pass the download URL and auth header for the vision module
-            return analyze_image_with_vision(media_url, meta_token=WHATSAPP_ACCESS_TOKEN)
+            return analyze_image_with_vision(
+                media_url, meta_token=WHATSAPP_ACCESS_TOKEN, image_hash=media_hash
+            )
     except Exception as e:
-        print(f"[ERROR] Image download: {e}")
+        log.error("[ERROR] Image download: %s", e)
 
     return (
         "⚠️ Handina kukwanisa kuona mufananidzo wacho. "
@@ -342,18 +485,33 @@ def _handle_image(media_id: str, sender: str) -> str:
     )
 
 
-def _handle_link(message: str, sender: str) -> str:
-    urls = extract_urls(message)
+def _media_info(media_id: str) -> tuple[str | None, str | None]:
+    """Return (download URL, SHA-256 of the file) for a WhatsApp media ID."""
+    resp = _HTTP.get(f"https://graph.facebook.com/{GRAPH_API_VERSION}/{media_id}")
+    resp.raise_for_status()
+    meta = resp.json()
+    return meta.get("url"), meta.get("sha256")
+
+
+# Scam forwards pair a phishing link with a decoy or two; beyond a handful
+# the extra reports only bloat the prompt
+MAX_LINKS_PER_MESSAGE = 4
+
+
+def _handle_link(message: str, urls: list, sender: str) -> str:
     if not urls:
         return analyze_text(message, content_type="text")
 
-    print(f"[PROCESS] Link scan: {urls[0]}")
-    scan_results = scan_url(urls[0])
-    scan_report = format_scan_results(scan_results)
+    # Scan each distinct URL (up to the cap) but analyse them together in a single AI call
+    urls = list(dict.fromkeys(urls))[:MAX_LINKS_PER_MESSAGE]
+    log.info("[PROCESS] Link scan: %s", ", ".join(urls))
+    scan_reports = "\n".join(
+        f"URL: {url}\n{format_scan_results(scan_url(url))}" for url in urls
+    )
 
     combined = (
-        f"URL submitted for analysis: {urls[0]}\n\n"
-        f"{scan_report}\n\n"
+        f"URL(s) submitted for analysis: {', '.join(urls)}\n\n"
+        f"{scan_reports}\n\n"
         f"Additional context from user: {message}"
     )
     return analyze_text(combined, content_type="link")
@@ -363,7 +521,7 @@ def _handle_link(message: str, sender: str) -> str:
 
 @app.route("/", methods=["GET"])
 def home():
-    return jsonify({
+    return _json_response({
         "service": "Chokwadi AI",
         "tagline": "Zvokwadi Zvinobatsira - The Truth Helps",
         "description": "Multimodal misinformation detection for Zimbabwean youth",
@@ -375,21 +533,27 @@ def home():
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok", "provider": _current_provider()})
+    return _json_response({
+        "status": "ok",
+        "provider": _current_provider(),
+        "cache": response_cache.stats(),
+    })
 
 
 # ─── Entry Point ───────────────────────────────────────────────────────────
+# Local development only. Production runs wsgi:app under gunicorn's gevent
+# workers (see Procfile) so slow LLM calls don't queue other webhooks.
 
 if __name__ == "__main__":
-    print("=" * 60)
-    print("🇿🇼  CHOKWADI AI - Zvokwadi Zvinobatsira")
-    print("    Multimodal Misinformation Detection for Zimbabwe")
-    print("    Powered by Meta WhatsApp Cloud API")
-    print("=" * 60)
-    print(f"  Provider : {_current_provider()}")
-    print(f"  Available: {', '.join(get_available_providers())}")
-    print(f"  Phone ID : {WHATSAPP_PHONE_NUMBER_ID}")
-    print(f"  Port     : {FLASK_PORT}")
-    print("=" * 60)
+    log.info(_BAR)
+    log.info("🇿🇼  CHOKWADI AI - Zvokwadi Zvinobatsira")
+    log.info("    Multimodal Misinformation Detection for Zimbabwe")
+    log.info("    Powered by Meta WhatsApp Cloud API")
+    log.info(_BAR)
+    log.info("  Provider : %s", _current_provider())
+    log.info("  Available: %s", ", ".join(get_available_providers()))
+    log.info("  Phone ID : %s", WHATSAPP_PHONE_NUMBER_ID)
+    log.info("  Port     : %s", FLASK_PORT)
+    log.info(_BAR)
 
     app.run(host="0.0.0.0", port=FLASK_PORT, debug=FLASK_DEBUG)
@@ -2,6 +2,8 @@
 Chokwadi AI - Configuration
 Supports Meta WhatsApp Cloud API + dual AI provider switching.
 """
+import functools
+import logging
 import os
 
 # --- AI API Keys ---
@@ -14,10 +16,22 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 # "auto"      = Anthropic first, fallback to OpenAI on failure
 AI_PROVIDER = os.getenv("AI_PROVIDER", "auto")
 
+# In auto mode, start the fallback provider if the primary hasn't answered
+# within this many seconds and take whichever responds first.
+HEDGE_DELAY_SECONDS = float(os.getenv("HEDGE_DELAY_SECONDS", "15"))
+
 CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
 OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4o")
 OPENAI_WHISPER_MODEL = "whisper-1"
 
+# --- Model Cascade ---
+# Text analyses go to the cheap model first and are re-run on the full model
+# only when its self-reported confidence is below the threshold.
+# Set a cheap model to "" to always use the full model for that provider.
+CLAUDE_CHEAP_MODEL = os.getenv("CLAUDE_CHEAP_MODEL", "claude-3-5-haiku-20241022")
+OPENAI_CHEAP_MODEL = os.getenv("OPENAI_CHEAP_MODEL", "gpt-4o-mini")
+CASCADE_CONFIDENCE_THRESHOLD = float(os.getenv("CASCADE_CONFIDENCE_THRESHOLD", "0.7"))
+
 # --- Meta WhatsApp Cloud API ---
 WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN", "")
 WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "")
@@ -28,22 +42,60 @@ GRAPH_API_VERSION = "v22.0"
 FLASK_PORT = int(os.getenv("PORT", os.getenv("FLASK_PORT", "5000")))
 FLASK_DEBUG = os.getenv("FLASK_DEBUG", "False").lower() == "true"
 
+# --- Webhook Workers ---
+# Messages are queued and processed in the background so Meta gets its 200
+# immediately instead of waiting on transcription and AI analysis.
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "500"))
+# Meta doesn't redeliver a message once it got its 200, so a stopping gunicorn
+# worker finishes its queue first (worker_exit hook), for at most this long
+# (keep it below --graceful-timeout). Messages still queued after that, or
+# queued under the local dev server, are lost.
+WEBHOOK_DRAIN_SECONDS = float(os.getenv("WEBHOOK_DRAIN_SECONDS", "25"))
+
 # --- Admin ---
-ADMIN_PHONE = os.getenv("ADMIN_PHONE", "")  # e.g. "263771841532" (no + prefix)
+# Comma-separated, e.g. "263771841532,263712345678" (no + prefix)
+ADMIN_PHONES = frozenset(
+    phone.strip() for phone in os.getenv("ADMIN_PHONE", "").split(",") if phone.strip()
+)
 
 # --- Rate Limiting ---
 MAX_REQUESTS_PER_USER_PER_HOUR = 20
 
+# --- Logging ---
+# DEBUG adds per-message detail (full inbound banner, send responses).
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# --- Response Cache ---
+# Identical prompts (viral forwards) are answered from cache instead of the API.
+# Set REDIS_URL to share the cache across gunicorn workers.
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+# --- Semantic Cache ---
+# Near-duplicate forwards (extra emoji, reordered lines, added filler such as
+# "please share") reuse a prior analysis when their bag-of-words cosine
+# similarity reaches the threshold and no other word differs.
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MIN_WORDS = 8
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(6 * 3600)))
+
 
-def get_available_providers() -> list:
+# Provider selection depends only on the settings above, which are fixed at
+# import, so each answer is computed once per worker.
+@functools.cache
+def get_available_providers() -> tuple[str, ...]:
     providers = []
     if ANTHROPIC_API_KEY:
         providers.append("anthropic")
     if OPENAI_API_KEY:
         providers.append("openai")
-    return providers
+    return tuple(providers)
 
 
+@functools.cache
 def get_active_provider() -> str:
     available = get_available_providers()
     if AI_PROVIDER == "auto":
@@ -56,11 +108,14 @@ def get_active_provider() -> str:
     if AI_PROVIDER in available:
         return AI_PROVIDER
     if available:
-        print(f"[WARN] '{AI_PROVIDER}' not configured, falling back to '{available[0]}'")
+        logging.getLogger("chokwadi").warning(
+            "[WARN] '%s' not configured, falling back to '%s'", AI_PROVIDER, available[0]
+        )
         return available[0]
     raise RuntimeError("No AI API keys configured!")
 
 
+@functools.cache
 def get_fallback_provider() -> str | None:
     if AI_PROVIDER != "auto":
         return None
@@ -3,193 +3,460 @@ Chokwadi AI - Core Analyzer
 Sends content to AI for credibility analysis.
 Supports Anthropic (Claude) and OpenAI (GPT) with automatic fallback.
 """
+import atexit
 import base64
+import io
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
 import anthropic
 import openai
 import httpx
+from cachetools import TTLCache
+from PIL import Image
 
 from config import (
     ANTHROPIC_API_KEY, OPENAI_API_KEY,
-    CLAUDE_MODEL, OPENAI_CHAT_MODEL,
-    get_active_provider, get_fallback_provider
+    CLAUDE_MODEL, OPENAI_CHAT_MODEL, HEDGE_DELAY_SECONDS,
+    CLAUDE_CHEAP_MODEL, OPENAI_CHEAP_MODEL, CASCADE_CONFIDENCE_THRESHOLD,
+    WEBHOOK_WORKERS, get_active_provider, get_fallback_provider
 )
 from prompts.system_prompt import (
     CHOKWADI_SYSTEM_PROMPT, LINK_ANALYSIS_PROMPT,
-    VOICE_NOTE_CONTEXT, IMAGE_CONTEXT
+    VOICE_NOTE_CONTEXT, IMAGE_CONTEXT, TEXT_CONTEXT, LINK_CONTEXT,
+    CONFIDENCE_INSTRUCTION
 )
+from core.cache import cache_key, response_cache
+from core.semantic_cache import semantic_cache
+from core.log import log
+
+
+# ─── Provider Clients ──────────────────────────────────────────────────────
+# Built once per worker so the SDKs' connection pools stay warm across
+# webhooks instead of paying a fresh TLS handshake on every call.
+
+_ANTHROPIC = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
+_OPENAI = openai.OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+
+# Each queue worker runs a primary and a hedge call, and a losing call keeps
+# its slot until it returns, so allow twice that. Under gevent these are
+# greenlets, so the headroom costs little.
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS * 4, thread_name_prefix="hedge")
+
+
+# ─── Provider Errors ───────────────────────────────────────────────────────
+# Rate limits (429), 5xx and connection errors are already retried with
+# backoff (honouring Retry-After) inside both SDKs, so by the time they
+# reach us the right move is the fallback provider. So is a plain 400: it is
+# also used for per-account problems (e.g. Anthropic's "credit balance is too
+# low") that the sibling provider doesn't share. Only a payload that is too
+# large or flagged by content policy would be refused by the sibling too.
+_REJECTED_STATUS = frozenset({413})
+_REJECTED_CODES = frozenset({"content_policy_violation"})
+
+
+class ProviderRejectedError(Exception):
+    """A provider refused the request itself; falling back won't help."""
+
+
+def _raise_if_rejected(provider: str, e: Exception):
+    if isinstance(e, (anthropic.APIStatusError, openai.APIStatusError)) \
+            and (e.status_code in _REJECTED_STATUS
+                 or getattr(e, "code", None) in _REJECTED_CODES):
+        log.error("[ERROR] %s rejected request (%s): %s", provider, e.status_code, e)
+        raise ProviderRejectedError(str(e)) from e
+
+
+def _hedged_call(call, primary: str, fallback: str | None) -> str | None:
+    """
+    Run call(primary); if it fails, or is still running after
+    HEDGE_DELAY_SECONDS, race call(fallback) and return the first success.
+
+    A losing call can't be interrupted mid-request, so it finishes in the
+    background and its answer still lands in the response cache. Once both
+    are racing, a ProviderRejectedError only knocks out the call that raised
+    it; the other may still answer.
+    """
+    if not fallback:
+        return call(primary)
+
+    first = _HEDGE_POOL.submit(call, primary)
+    try:
+        result = first.result(timeout=HEDGE_DELAY_SECONDS)
+        if result is not None:
+            return result
+        log.info("[FALLBACK] %s failed, trying %s...", primary, fallback)
+        return call(fallback)
+    except TimeoutError:
+        log.info("[HEDGE] %s slow after %ss, racing %s...", primary, HEDGE_DELAY_SECONDS, fallback)
+
+    pending = {first, _HEDGE_POOL.submit(call, fallback)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except ProviderRejectedError:
+                continue
+            if result is not None:
+                return result
+    return None
 
 
 # ─── Text / Transcription / Link Analysis ─────────────────────────────────
 
+# System blocks per content type, composed once at import
+_SYSTEM_BY_TYPE = {
+    "voice": (CHOKWADI_SYSTEM_PROMPT, VOICE_NOTE_CONTEXT),
+    "image": (CHOKWADI_SYSTEM_PROMPT, IMAGE_CONTEXT),
+    "link": (CHOKWADI_SYSTEM_PROMPT, LINK_ANALYSIS_PROMPT + "\n\n" + LINK_CONTEXT),
+    "text": (CHOKWADI_SYSTEM_PROMPT, TEXT_CONTEXT),
+}
+
+
 def analyze_text(content: str, content_type: str = "text") -> str:
     """
     Analyse content for misinformation using the configured AI provider.
+
+    The static prompt text lives entirely in the system blocks so providers
+    can serve it from their prefix cache; only `content` varies per request.
     """
-    if content_type == "voice":
-        user_message = VOICE_NOTE_CONTEXT + content
-    elif content_type == "image":
-        user_message = IMAGE_CONTEXT + content
-    elif content_type == "link":
-        user_message = f"Please analyse this URL/link for safety and credibility:\n\n{content}"
-    else:
-        user_message = f"Please analyse the following content for credibility and misinformation:\n\n{content}"
+    system = _SYSTEM_BY_TYPE.get(content_type, _SYSTEM_BY_TYPE["text"])
+    user_message = content
 
-    system = CHOKWADI_SYSTEM_PROMPT
-    if content_type == "link":
-        system += "\n\n" + LINK_ANALYSIS_PROMPT
+    # Link reports embed a fresh scan, so only plain content is fuzzy-matched
+    use_semantic = content_type != "link"
+    if use_semantic:
+        cached = semantic_cache.get(content_type, content)
+        if cached is not None:
+            return cached
 
-    primary = get_active_provider()
-    fallback = get_fallback_provider()
+    try:
+        result = _hedged_call(
+            lambda provider: _call_provider(provider, system, user_message),
+            get_active_provider(),
+            get_fallback_provider(),
+        )
+    except ProviderRejectedError:
+        result = None
+    if result is None:
+        return _error_response()
+
+    if use_semantic:
+        semantic_cache.add(content_type, content, result)
+    return result
+
+
+_CONFIDENCE_RE = re.compile(
+    r'\s*`*(?:json)?\s*\{\s*"confidence"\s*:\s*([0-9]*\.?[0-9]+)\s*\}\s*`*\s*$'
+)
 
-    result = _call_provider(primary, system, user_message)
-    if result is not None:
-        return result
 
-    if fallback:
-        print(f"[FALLBACK] {primary} failed, trying {fallback}...")
-        result = _call_provider(fallback, system, user_message)
-        if result is not None:
-            return result
+def _split_confidence(text: str) -> tuple[str, float | None]:
+    """Strip the trailing {"confidence": x} line; None if it's missing."""
+    match = _CONFIDENCE_RE.search(text)
+    if not match:
+        return text, None
+    return text[:match.start()].rstrip(), float(match.group(1))
 
-    return _error_response()
 
+def _call_provider(provider: str, system: tuple[str, ...], user_message: str) -> str | None:
+    """
+    Cascade within one provider: the cheap model answers when it reports
+    enough confidence, otherwise (or on any failure) the full model runs.
+    """
+    if provider == "anthropic":
+        cheap_model, full_model = CLAUDE_CHEAP_MODEL, CLAUDE_MODEL
+    else:
+        cheap_model, full_model = OPENAI_CHEAP_MODEL, OPENAI_CHAT_MODEL
+
+    if cheap_model:
+        try:
+            draft = _call_model(provider, cheap_model, system + (CONFIDENCE_INSTRUCTION,), user_message)
+        except ProviderRejectedError:
+            draft = None  # Let the full model make the final call
+        if draft is not None:
+            text, confidence = _split_confidence(draft)
+            if confidence is not None and confidence >= CASCADE_CONFIDENCE_THRESHOLD:
+                log.info("[TIER] %s answered (confidence %.2f)", cheap_model, confidence)
+                return text
+            log.info("[TIER] %s escalating to %s (confidence %s)", cheap_model, full_model, confidence)
+
+    return _call_model(provider, full_model, system, user_message)
+
+
+def _call_model(provider: str, model: str, system: tuple[str, ...], user_message: str) -> str | None:
+    key = cache_key(model, system, user_message)
+    cached = response_cache.get(key)
+    if cached is not None:
+        log.info("[CACHE] Hit for %s (%s)", model, key[:12])
+        return cached
 
-def _call_provider(provider: str, system: str, user_message: str) -> str | None:
     try:
         if provider == "anthropic":
-            return _call_claude(system, user_message)
+            result = _call_claude(model, system, user_message)
         else:
-            return _call_openai(system, user_message)
+            result = _call_openai(model, system, user_message)
     except Exception as e:
-        print(f"[ERROR] {provider} API error: {e}")
+        _raise_if_rejected(provider, e)
+        log.error("[ERROR] %s API error: %s", provider, e)
         return None
 
+    if result:
+        response_cache.set(key, result)
+    return result
 
-def _call_claude(system: str, user_message: str) -> str:
-    client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-    response = client.messages.create(
-        model=CLAUDE_MODEL,
+
+def _cached_system_blocks(system: tuple[str, ...]) -> list[dict]:
+    """Mark each static system block for Anthropic's ephemeral prompt cache."""
+    return [
+        {"type": "text", "text": block, "cache_control": {"type": "ephemeral"}}
+        for block in system
+    ]
+
+
+_VISION_SYSTEM_BLOCKS = _cached_system_blocks((CHOKWADI_SYSTEM_PROMPT,))
+
+
+def _call_claude(model: str, system: tuple[str, ...], user_message: str) -> str:
+    with _ANTHROPIC.messages.stream(
+        model=model,
         max_tokens=1024,
-        system=system,
+        system=_cached_system_blocks(system),
         messages=[{"role": "user", "content": user_message}],
-    )
-    return response.content[0].text
+    ) as stream:
+        return "".join(stream.text_stream)
 
 
-def _call_openai(system: str, user_message: str) -> str:
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
-    response = client.chat.completions.create(
-        model=OPENAI_CHAT_MODEL,
+def _call_openai(model: str, system: tuple[str, ...], user_message: str) -> str:
+    # System text first so OpenAI's automatic prefix cache can match it
+    stream = _OPENAI.chat.completions.create(
+        model=model,
         max_tokens=1024,
         messages=[
-            {"role": "system", "content": system},
+            {"role": "system", "content": "\n\n".join(system)},
             {"role": "user", "content": user_message},
         ],
+        stream=True,
+    )
+    return _join_openai_stream(stream)
+
+
+def _join_openai_stream(stream) -> str:
+    """Accumulate streamed completion deltas into the full reply text."""
+    return "".join(
+        chunk.choices[0].delta.content or ""
+        for chunk in stream
+        if chunk.choices
     )
-    return response.choices[0].message.content
 
 
 # ─── Image / Vision Analysis ──────────────────────────────────────────────
 
-def analyze_image_with_vision(image_url: str, meta_token: str = None) -> str:
+_VISION_INSTRUCTION = (
+    "Please analyse this image for misinformation, scams, or manipulated content. "
+    "Extract any visible text and assess the credibility of the claims made."
+)
+
+
+# Forwarded images arrive under new media IDs but with the same file hash
+_VISION_CACHE = TTLCache(maxsize=2000, ttl=6 * 3600)
+_VISION_CACHE_LOCK = threading.Lock()
+
+
+def analyze_image_with_vision(image_url: str, meta_token: str = None,
+                              image_hash: str = None) -> str:
     """
     Analyse an image directly using vision capabilities.
 
     Args:
         image_url:   URL of the image to analyse
-        meta_token:  Meta WhatsApp access token for downloading media
+        meta_token:  Meta WhatsApp access token for downloading media.
+                     Without it the URL must be public and is passed to the
+                     provider as-is instead of being downloaded here.
+        image_hash:  Content hash of the image (Meta's media `sha256`), used
+                     to reuse the analysis of an identical forward
     """
-    primary = get_active_provider()
-    fallback = get_fallback_provider()
-
-    result = _call_vision_provider(primary, image_url, meta_token)
-    if result is not None:
-        return result
-
-    if fallback:
-        print(f"[FALLBACK] {primary} vision failed, trying {fallback}...")
-        result = _call_vision_provider(fallback, image_url, meta_token)
-        if result is not None:
-            return result
-
-    return _error_response()
-
+    if image_hash:
+        with _VISION_CACHE_LOCK:
+            cached = _VISION_CACHE.get(image_hash)
+        if cached is not None:
+            log.info("[VISION CACHE] Hit")
+            return cached
+
+    # Download and encode once; the primary and a hedged fallback share it
+    image = None
+    if meta_token:
+        try:
+            image = _fetch_encoded(image_url, meta_token)
+        except Exception as e:
+            log.error("[ERROR] Image download failed: %s", e)
+            return _error_response()
 
-def _call_vision_provider(provider: str, image_url: str, meta_token: str = None) -> str | None:
+    try:
+        result = _hedged_call(
+            lambda provider: _call_vision_provider(provider, image_url, image),
+            get_active_provider(),
+            get_fallback_provider(),
+        )
+    except ProviderRejectedError:
+        result = None
+    if result is None:
+        return _error_response()
+
+    if image_hash:
+        with _VISION_CACHE_LOCK:
+            _VISION_CACHE[image_hash] = result
+    return result
+
+
+def _call_vision_provider(provider: str, image_url: str,
+                          image: tuple[str, str] | None) -> str | None:
     try:
         if provider == "anthropic":
-            return _vision_claude(image_url, meta_token)
+            return _vision_claude(image_url, image)
         else:
-            return _vision_openai(image_url, meta_token)
+            return _vision_openai(image_url, image)
     except Exception as e:
-        print(f"[ERROR] {provider} vision error: {e}")
+        _raise_if_rejected(provider, e)
+        log.error("[ERROR] %s vision error: %s", provider, e)
         return None
 
 
-def _download_image(image_url: str, meta_token: str = None) -> tuple[bytes, str]:
-    """Download image bytes from Meta CDN or any URL."""
+_DOWNLOAD_TIMEOUT = httpx.Timeout(10.0, read=20.0)
+_DOWNLOAD_ATTEMPTS = 3
+
+# Shared pool so image downloads reuse warm connections to Meta's CDN
+_MEDIA_HTTP = httpx.Client(
+    follow_redirects=True,
+    timeout=_DOWNLOAD_TIMEOUT,
+    limits=httpx.Limits(max_keepalive_connections=32),
+)
+atexit.register(_MEDIA_HTTP.close)
+_IMAGE_MEDIA_TYPES = frozenset({"image/png", "image/webp", "image/gif", "image/jpeg"})
+
+
+def _download_image(image_url: str, meta_token: str = None) -> tuple[bytearray, str]:
+    """
+    Download image bytes from Meta CDN or any URL.
+
+    The body is streamed into one buffer. Transport errors and 5xx responses
+    are retried with exponential backoff; 4xx responses fail immediately.
+    """
     headers = {}
     if meta_token:
         headers["Authorization"] = f"Bearer {meta_token}"
 
-    resp = httpx.get(image_url, headers=headers, follow_redirects=True, timeout=30)
-    resp.raise_for_status()
+    for attempt in range(1, _DOWNLOAD_ATTEMPTS + 1):
+        try:
+            with _MEDIA_HTTP.stream("GET", image_url, headers=headers) as resp:
+                resp.raise_for_status()
+                content_type = resp.headers.get("content-type", "image/jpeg")
+                data = bytearray()
+                for chunk in resp.iter_bytes(chunk_size=65536):
+                    data += chunk
+            break
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            retryable = isinstance(e, httpx.TransportError) or e.response.status_code >= 500
+            if not retryable or attempt == _DOWNLOAD_ATTEMPTS:
+                raise
+            log.warning("[RETRY] Image download attempt %d failed: %s", attempt, e)
+            time.sleep(0.5 * 2 ** (attempt - 1))
+
+    mime = content_type.split(";", 1)[0].strip().lower()
+    media_type = mime if mime in _IMAGE_MEDIA_TYPES else "image/jpeg"
+
+    return data, media_type
+
+
+# Vision models read a meme or screenshot just as well at this size, and a
+# JPEG of it is a fraction of the multi-MB PNG WhatsApp often delivers.
+_MAX_IMAGE_SIDE = 1280
+_JPEG_QUALITY = 85
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """RGB copy of img; transparent areas are painted white, not black."""
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def _shrink_image(data: bytes, media_type: str) -> tuple[bytes, str]:
+    """Re-encode as JPEG, longest side at most _MAX_IMAGE_SIDE, when that is smaller."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if media_type == "image/jpeg" and max(img.size) <= _MAX_IMAGE_SIDE:
+                return data, media_type
+            # Lets the JPEG decoder downscale while decoding
+            img.draft("RGB", (_MAX_IMAGE_SIDE, _MAX_IMAGE_SIDE))
+            img.thumbnail((_MAX_IMAGE_SIDE, _MAX_IMAGE_SIDE))
+            buf = io.BytesIO()
+            _flatten(img).save(buf, "JPEG", quality=_JPEG_QUALITY, optimize=True)
+    except Exception as e:
+        log.warning("[IMAGE] Recompression skipped: %s", e)
+        return data, media_type
 
-    content_type = resp.headers.get("content-type", "image/jpeg")
-    if "png" in content_type:
-        media_type = "image/png"
-    elif "webp" in content_type:
-        media_type = "image/webp"
-    elif "gif" in content_type:
-        media_type = "image/gif"
-    else:
-        media_type = "image/jpeg"
+    if buf.tell() >= len(data):
+        return data, media_type
+    return buf.getvalue(), "image/jpeg"
 
-    return resp.content, media_type
 
+def _fetch_encoded(image_url: str, meta_token: str = None) -> tuple[str, str]:
+    """Download, shrink and base64-encode an image for the vision providers."""
+    image_data, media_type = _shrink_image(*_download_image(image_url, meta_token))
+    # Decoded to str once here, so both providers reuse it as-is
+    return media_type, base64.standard_b64encode(image_data).decode("ascii")
 
-def _vision_claude(image_url: str, meta_token: str = None) -> str:
-    image_data, media_type = _download_image(image_url, meta_token)
-    image_b64 = base64.standard_b64encode(image_data).decode("utf-8")
 
-    client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-    response = client.messages.create(
+def _vision_claude(image_url: str, image: tuple[str, str] | None) -> str:
+    if image is not None:
+        media_type, image_b64 = image
+        source = {
+            "type": "base64",
+            "media_type": media_type,
+            "data": image_b64,
+        }
+    else:
+        # Public URL: let Anthropic fetch it rather than download and re-upload
+        source = {"type": "url", "url": image_url}
+
+    with _ANTHROPIC.messages.stream(
         model=CLAUDE_MODEL,
         max_tokens=1024,
-        system=CHOKWADI_SYSTEM_PROMPT,
+        system=_VISION_SYSTEM_BLOCKS,
         messages=[
             {
                 "role": "user",
                 "content": [
                     {
                         "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": media_type,
-                            "data": image_b64,
-                        },
+                        "source": source,
                     },
                     {
                         "type": "text",
-                        "text": (
-                            "Please analyse this image for misinformation, scams, or manipulated content. "
-                            "Extract any visible text and assess the credibility of the claims made."
-                        ),
+                        "text": _VISION_INSTRUCTION,
                     },
                 ],
             }
         ],
-    )
-    return response.content[0].text
+    ) as stream:
+        return "".join(stream.text_stream)
 
 
-def _vision_openai(image_url: str, meta_token: str = None) -> str:
-    image_data, media_type = _download_image(image_url, meta_token)
-    image_b64 = base64.standard_b64encode(image_data).decode("utf-8")
-    data_uri = f"data:{media_type};base64,{image_b64}"
+def _vision_openai(image_url: str, image: tuple[str, str] | None) -> str:
+    if image is not None:
+        media_type, image_b64 = image
+        image_ref = f"data:{media_type};base64,{image_b64}"
+    else:
+        # Public URL: OpenAI fetches it directly, no base64 inflation
+        image_ref = image_url
 
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
-    response = client.chat.completions.create(
+    stream = _OPENAI.chat.completions.create(
         model=OPENAI_CHAT_MODEL,
         max_tokens=1024,
         messages=[
@@ -199,20 +466,18 @@ def _vision_openai(image_url: str, meta_token: str = None) -> str:
                 "content": [
                     {
                         "type": "text",
-                        "text": (
-                            "Please analyse this image for misinformation, scams, or manipulated content. "
-                            "Extract any visible text and assess the credibility of the claims made."
-                        ),
+                        "text": _VISION_INSTRUCTION,
                     },
                     {
                         "type": "image_url",
-                        "image_url": {"url": data_uri},
+                        "image_url": {"url": image_ref},
                     },
                 ],
             },
         ],
+        stream=True,
     )
-    return response.choices[0].message.content
+    return _join_openai_stream(stream)
 
 
 # ─── Error Response ────────────────────────────────────────────────────────
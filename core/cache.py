@@ -0,0 +1,140 @@
+"""
+Chokwadi AI - Response Cache
+Content-addressable cache for AI provider responses.
+Viral forwards arrive many times over, so identical prompts skip the API call.
+"""
+import hashlib
+import json
+import threading
+
+from cachetools import TTLCache
+
+from config import (
+    RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS, REDIS_URL
+)
+from core.log import log
+
+# Fail fast if Redis hangs instead of refusing; lookups sit on the webhook path
+_REDIS_TIMEOUTS = {"socket_timeout": 0.5, "socket_connect_timeout": 0.5}
+
+
+def _redis_client(redis_url: str):
+    import redis
+    return redis.Redis.from_url(redis_url, decode_responses=True, **_REDIS_TIMEOUTS)
+
+
+def cache_key(model: str, system: tuple[str, ...], user: str) -> str:
+    """
+    SHA-256 over the exact inputs that determine the model's answer.
+
+    `system` is the ordered tuple of system blocks; it is serialised as a
+    JSON array, so the same text split into different blocks gets a
+    different key.
+    """
+    payload = json.dumps({"model": model, "system": system, "user": user}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Response cache with an in-process TTL backend, or Redis when configured.
+
+    Args:
+        maxsize:    Max entries held in-process (ignored for Redis)
+        ttl:        Seconds an entry stays valid
+        redis_url:  Optional Redis URL, shared across workers
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: int = 86400, redis_url: str = ""):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._redis = None
+        self._local = None
+
+        if redis_url:
+            self._redis = _redis_client(redis_url)
+        else:
+            self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @property
+    def backend(self) -> str:
+        return "redis" if self._redis is not None else "memory"
+
+    def get(self, key: str) -> str | None:
+        try:
+            if self._redis is not None:
+                value = self._redis.get(key)
+            else:
+                with self._lock:
+                    value = self._local.get(key)
+        except Exception as e:
+            log.error("[CACHE ERROR] get: %s", e)
+            value = None
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        try:
+            if self._redis is not None:
+                self._redis.setex(key, self.ttl, value)
+            else:
+                with self._lock:
+                    self._local[key] = value
+        except Exception as e:
+            log.error("[CACHE ERROR] set: %s", e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": self.backend, "hits": self.hits, "misses": self.misses}
+
+
+class MessageDedupe:
+    """
+    Remembers recent message IDs so a webhook redelivery is handled once.
+    With Redis the IDs are shared across gunicorn workers (SET NX EX);
+    otherwise each worker only knows its own.
+
+    Args:
+        ttl:        Seconds an ID is remembered
+        maxsize:    Max IDs held in-process (ignored for Redis)
+        redis_url:  Optional Redis URL, shared across workers
+    """
+
+    def __init__(self, ttl: int = 900, maxsize: int = 20_000, redis_url: str = ""):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._redis = _redis_client(redis_url) if redis_url else None
+        self._local = None if self._redis is not None else TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def seen_before(self, message_id: str) -> bool:
+        if not message_id:
+            return False
+        if self._redis is not None:
+            try:
+                return not self._redis.set(f"seen:{message_id}", "1", nx=True, ex=self.ttl)
+            except Exception as e:
+                # Better a rare double reply than a dropped message
+                log.error("[DEDUPE ERROR] %s", e)
+                return False
+        with self._lock:
+            if message_id in self._local:
+                return True
+            self._local[message_id] = True
+            return False
+
+
+response_cache = LLMCache(
+    maxsize=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=RESPONSE_CACHE_TTL_SECONDS,
+    redis_url=REDIS_URL,
+)
+
+# Meta redelivers a webhook when our 200 is slow or lost
+message_dedupe = MessageDedupe(ttl=900, redis_url=REDIS_URL)
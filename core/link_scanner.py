@@ -2,12 +2,19 @@
 Chokwadi AI - Link Scanner
 Cybersecurity module for URL/link analysis and phishing detection
 """
+import functools
+import ipaddress
 import re
 from urllib.parse import urlparse
 
+try:
+    from rapidfuzz.distance import Levenshtein
+except ImportError:  # Pure-Python distance below is used instead
+    Levenshtein = None
+
 
 # Known legitimate Zimbabwean domains for comparison
-LEGITIMATE_ZW_DOMAINS = {
+LEGITIMATE_ZW_DOMAINS = frozenset({
     "ecocash.co.zw", "innbucks.co.zw", "rbz.co.zw", "zimra.co.zw",
     "zse.co.zw", "herald.co.zw", "chronicle.co.zw", "newsday.co.zw",
     "techzim.co.zw", "zbc.co.zw", "parlzim.gov.zw", "zimgov.gov.zw",
@@ -15,13 +22,14 @@ LEGITIMATE_ZW_DOMAINS = {
     "uz.ac.zw", "nust.ac.zw", "hit.ac.zw", "msu.ac.zw",
     "steward.co.zw", "cbz.co.zw", "stanbicbank.co.zw", "zetdc.co.zw",
     "econet.co.zw", "netone.co.zw", "telecel.co.zw",
-}
+})
 
 # Common phishing TLDs and patterns
-SUSPICIOUS_TLDS = {
+SUSPICIOUS_TLDS = frozenset({
     ".xyz", ".top", ".club", ".work", ".click", ".link",
     ".buzz", ".gq", ".ml", ".cf", ".tk", ".ga",
-}
+})
+_SUSPICIOUS_TLDS_TUPLE = tuple(sorted(SUSPICIOUS_TLDS))
 
 # Known scam URL patterns in Zimbabwe
 SCAM_PATTERNS = [
@@ -38,11 +46,28 @@ SCAM_PATTERNS = [
     r"crypto.*invest.*zim",
     r"whatsapp.*gold",
 ]
+# One alternation, so the URL is searched in a single regex call
+_SCAM_RE = re.compile("|".join(f"(?:{p})" for p in SCAM_PATTERNS))
+
+# Path words typical of credential phishing, in reporting priority order
+SUSPICIOUS_PATH_WORDS = ("login", "signin", "verify", "update", "secure", "account", "confirm")
+_SUSPICIOUS_PATH_RE = re.compile("|".join(SUSPICIOUS_PATH_WORDS))
+
+URL_SHORTENERS = ("bit.ly", "tinyurl.com", "t.co", "goo.gl", "is.gd", "rb.gy", "shorturl.at")
+_SHORTENER_RE = re.compile("|".join(map(re.escape, URL_SHORTENERS)))
+
+
+RISK_LEVELS = ("low", "medium", "high", "critical")
+RISK_LOW, RISK_MEDIUM, RISK_HIGH, RISK_CRITICAL = range(len(RISK_LEVELS))
+_RISK_EMOJI = dict(zip(RISK_LEVELS, ("🟢", "🟡", "🔴", "🚨")))
 
 
 def scan_url(url: str) -> dict:
     """
     Perform security analysis on a URL.
+
+    The scan depends only on the URL string, so results are memoised; each
+    caller gets its own copy of the findings to modify freely.
     
     Args:
         url: The URL to analyse
@@ -50,78 +75,81 @@ def scan_url(url: str) -> dict:
     Returns:
         dict with security findings
     """
+    findings = _scan_url(url)
+    return {**findings, "issues": list(findings["issues"]), "details": dict(findings["details"])}
+
+
+@functools.lru_cache(maxsize=4096)
+def _scan_url(url: str) -> dict:
     findings = {
         "url": url,
         "risk_level": "low",  # low, medium, high, critical
         "issues": [],
         "details": {}
     }
+    risk = RISK_LOW  # only goes up, never down
     
     try:
-        parsed = urlparse(url)
-        domain = parsed.netloc.lower()
-        path = parsed.path.lower()
+        # Lowercase once and parse that; URL delimiters are unaffected
         full_url_lower = url.lower()
+        parsed = urlparse(full_url_lower)
+        domain = parsed.netloc
+        path = parsed.path
+        is_known = domain in LEGITIMATE_ZW_DOMAINS
         
         # --- Check 1: Missing HTTPS ---
         if parsed.scheme == "http":
             findings["issues"].append("No HTTPS encryption - data sent insecurely")
-            _escalate_risk(findings, "medium")
+            risk = max(risk, RISK_MEDIUM)
         
         # --- Check 2: Suspicious TLD ---
-        for tld in SUSPICIOUS_TLDS:
-            if domain.endswith(tld):
-                findings["issues"].append(f"Suspicious domain extension ({tld}) commonly used in scams")
-                _escalate_risk(findings, "high")
-                break
+        if domain.endswith(_SUSPICIOUS_TLDS_TUPLE):
+            tld = next(t for t in _SUSPICIOUS_TLDS_TUPLE if domain.endswith(t))
+            findings["issues"].append(f"Suspicious domain extension ({tld}) commonly used in scams")
+            risk = max(risk, RISK_HIGH)
         
         # --- Check 3: Typosquatting detection ---
-        typosquat = _check_typosquatting(domain)
+        typosquat = None if is_known else _typosquat_target(domain.partition('.')[0])
         if typosquat:
             findings["issues"].append(
                 f"Possible impersonation of '{typosquat}' - domain looks similar but isn't the real site"
             )
-            _escalate_risk(findings, "critical")
+            risk = max(risk, RISK_CRITICAL)
         
         # --- Check 4: Known scam patterns ---
-        for pattern in SCAM_PATTERNS:
-            if re.search(pattern, full_url_lower):
-                findings["issues"].append(
-                    "URL matches known Zimbabwean scam/fraud patterns"
-                )
-                _escalate_risk(findings, "high")
-                break
+        if _SCAM_RE.search(full_url_lower):
+            findings["issues"].append(
+                "URL matches known Zimbabwean scam/fraud patterns"
+            )
+            risk = max(risk, RISK_HIGH)
         
         # --- Check 5: URL length and complexity ---
         if len(url) > 200:
             findings["issues"].append("Unusually long URL - may be disguising destination")
-            _escalate_risk(findings, "medium")
+            risk = max(risk, RISK_MEDIUM)
         
         # --- Check 6: Suspicious path elements ---
-        sus_paths = ["login", "signin", "verify", "update", "secure", "account", "confirm"]
-        for sus in sus_paths:
-            if sus in path and domain not in LEGITIMATE_ZW_DOMAINS:
-                findings["issues"].append(
-                    f"Contains '{sus}' in path on non-official domain - possible phishing"
-                )
-                _escalate_risk(findings, "high")
-                break
+        if not is_known and _SUSPICIOUS_PATH_RE.search(path):
+            sus = next(s for s in SUSPICIOUS_PATH_WORDS if s in path)
+            findings["issues"].append(
+                f"Contains '{sus}' in path on non-official domain - possible phishing"
+            )
+            risk = max(risk, RISK_HIGH)
         
         # --- Check 7: IP address instead of domain ---
-        if re.match(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', domain):
+        if _is_ip_address(parsed.hostname):
             findings["issues"].append("Uses IP address instead of domain name - highly suspicious")
-            _escalate_risk(findings, "critical")
+            risk = max(risk, RISK_CRITICAL)
         
         # --- Check 8: Excessive subdomains ---
         if domain.count('.') > 3:
             findings["issues"].append("Excessive subdomains - may be impersonating a legitimate site")
-            _escalate_risk(findings, "medium")
+            risk = max(risk, RISK_MEDIUM)
         
         # --- Check 9: URL shortener ---
-        shorteners = ["bit.ly", "tinyurl.com", "t.co", "goo.gl", "is.gd", "rb.gy", "shorturl.at"]
-        if any(s in domain for s in shorteners):
+        if _SHORTENER_RE.search(domain):
             findings["issues"].append("Uses URL shortener - destination is hidden")
-            _escalate_risk(findings, "medium")
+            risk = max(risk, RISK_MEDIUM)
         
         # --- Summary ---
         if not findings["issues"]:
@@ -130,84 +158,125 @@ def scan_url(url: str) -> dict:
         findings["details"] = {
             "domain": domain,
             "scheme": parsed.scheme,
-            "is_known_zw_domain": domain in LEGITIMATE_ZW_DOMAINS,
+            "is_known_zw_domain": is_known,
         }
     
     except Exception as e:
         findings["issues"].append(f"Could not fully analyse URL: {str(e)}")
-        _escalate_risk(findings, "medium")
+        risk = max(risk, RISK_MEDIUM)
     
+    findings["risk_level"] = RISK_LEVELS[risk]
     return findings
 
 
-def _escalate_risk(findings: dict, new_level: str):
-    """Escalate risk level (only goes up, never down)."""
-    levels = {"low": 0, "medium": 1, "high": 2, "critical": 3}
-    if levels.get(new_level, 0) > levels.get(findings["risk_level"], 0):
-        findings["risk_level"] = new_level
-
-
-def _check_typosquatting(domain: str) -> str | None:
-    """Check if a domain is a typosquat of a known Zimbabwean domain."""
-    # Simple Levenshtein-like check for common targets
-    typosquat_targets = {
-        "ecocash": "ecocash.co.zw",
-        "innbucks": "innbucks.co.zw",
-        "econet": "econet.co.zw",
-        "cbz": "cbz.co.zw",
-        "steward": "steward.co.zw",
-        "zimra": "zimra.co.zw",
-        "rbz": "rbz.co.zw",
-    }
-    
-    domain_base = domain.split('.')[0].lower()
-    
-    for target_base, target_full in typosquat_targets.items():
-        if domain not in LEGITIMATE_ZW_DOMAINS:
-            # Check for common typosquatting: character substitution, extra chars
-            if (target_base in domain_base and domain_base != target_base) or \
-               (_levenshtein_distance(domain_base, target_base) <= 2 and domain_base != target_base):
-                return target_full
+def _is_ip_address(host: str | None) -> bool:
+    """True for a literal IPv4 or IPv6 address (port and brackets already stripped)."""
+    if not host:
+        return False
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+# Brands most often impersonated, as (domain label, real site)
+TYPOSQUAT_TARGETS = {
+    "ecocash": "ecocash.co.zw",
+    "innbucks": "innbucks.co.zw",
+    "econet": "econet.co.zw",
+    "cbz": "cbz.co.zw",
+    "steward": "steward.co.zw",
+    "zimra": "zimra.co.zw",
+    "rbz": "rbz.co.zw",
+}
+
+
+def _pattern_masks(pattern: str) -> dict[str, int]:
+    """Per-character bit masks of the positions it occupies in `pattern`."""
+    peq = {}
+    for i, c in enumerate(pattern):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    return peq
+
+
+@functools.lru_cache(maxsize=4096)
+def _typosquat_target(domain_base: str) -> str | None:
+    """
+    Check if a domain's leftmost label is a typosquat of a known Zimbabwean
+    domain, returning the real site. Memoised per label; callers skip it
+    for domains already in LEGITIMATE_ZW_DOMAINS.
+    """
+    for target_base, target_full, target_masks in _TYPOSQUAT_TABLE:
+        if domain_base == target_base:
+            continue
+        # Check for common typosquatting: extra chars, then character substitution.
+        # Edit distance is at least the length difference, so skip hopeless pairs.
+        if target_base in domain_base or \
+           (abs(len(domain_base) - len(target_base)) <= 2
+                and _edit_distance(domain_base, target_base, target_masks, 2) <= 2):
+            return target_full
     
     return None
 
 
-def _levenshtein_distance(s1: str, s2: str) -> int:
-    """Calculate Levenshtein distance between two strings."""
-    if len(s1) < len(s2):
-        return _levenshtein_distance(s2, s1)
-    if len(s2) == 0:
-        return len(s1)
-    
-    prev_row = range(len(s2) + 1)
-    for i, c1 in enumerate(s1):
-        curr_row = [i + 1]
-        for j, c2 in enumerate(s2):
-            insertions = prev_row[j + 1] + 1
-            deletions = curr_row[j] + 1
-            substitutions = prev_row[j] + (c1 != c2)
-            curr_row.append(min(insertions, deletions, substitutions))
-        prev_row = curr_row
-    
-    return prev_row[-1]
+def _edit_distance(text: str, target: str, target_masks: dict[str, int], cutoff: int) -> int:
+    """Levenshtein distance; any result above `cutoff` means "too far"."""
+    if Levenshtein is not None:
+        return Levenshtein.distance(text, target, score_cutoff=cutoff)
+    return _myers_distance(text, target_masks, len(target))
+
+
+def _myers_distance(text: str, peq: dict[str, int], m: int) -> int:
+    """
+    Levenshtein distance between `text` and a pattern of length `m` whose
+    _pattern_masks are `peq`.
+
+    Uses Myers' bit-parallel algorithm (Hyyrö's formulation): one column of
+    the DP matrix is held as bit vectors, so each character of text costs a
+    handful of integer operations instead of a row of cell updates.
+    Python ints are unbounded, so strings of any length are handled.
+    """
+    if m == 0:
+        return len(text)
+
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    vp, vn, score = mask, 0, m
+    for c in text:
+        eq = peq.get(c, 0)
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        hp = vn | ~(xh | vp)
+        hn = vp & xh
+        if hp & last:
+            score += 1
+        elif hn & last:
+            score -= 1
+        hp = (hp << 1) | 1
+        hn <<= 1
+        vp = (hn | ~(xv | hp)) & mask
+        vn = hp & xv & mask
+
+    return score
+
+
+# Target masks are built once here rather than on every scan
+_TYPOSQUAT_TABLE = [
+    (base, full, _pattern_masks(base)) for base, full in TYPOSQUAT_TARGETS.items()
+]
 
 
 def format_scan_results(scan: dict) -> str:
     """Format scan results for inclusion in AI prompt."""
-    risk_emoji = {
-        "low": "🟢",
-        "medium": "🟡",
-        "high": "🔴",
-        "critical": "🚨"
-    }
-    
-    result = f"AUTOMATED SECURITY SCAN RESULTS:\n"
-    result += f"Risk Level: {risk_emoji.get(scan['risk_level'], '⚪')} {scan['risk_level'].upper()}\n"
-    result += f"Issues found:\n"
-    for issue in scan["issues"]:
-        result += f"  - {issue}\n"
+    parts = [
+        "AUTOMATED SECURITY SCAN RESULTS:\n",
+        f"Risk Level: {_RISK_EMOJI.get(scan['risk_level'], '⚪')} {scan['risk_level'].upper()}\n",
+        "Issues found:\n",
+    ]
+    parts.extend(f"  - {issue}\n" for issue in scan["issues"])
     
     if scan.get("details", {}).get("is_known_zw_domain"):
-        result += f"  ✅ Domain is a known legitimate Zimbabwean website\n"
+        parts.append("  ✅ Domain is a known legitimate Zimbabwean website\n")
     
-    return result
+    return "".join(parts)
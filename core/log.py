@@ -0,0 +1,27 @@
+"""
+Chokwadi AI - Logging
+Records are queued on the request thread and written to stdout by a
+background listener, so webhook handlers never block on the stdout pipe.
+"""
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_LEVEL
+
+log = logging.getLogger("chokwadi")
+
+if not log.handlers:
+    _queue = queue.SimpleQueue()
+    _stdout = logging.StreamHandler(sys.stdout)
+    _stdout.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    _listener = QueueListener(_queue, _stdout)
+
+    log.addHandler(QueueHandler(_queue))
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+
+    _listener.start()
+    atexit.register(_listener.stop)
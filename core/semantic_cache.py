@@ -0,0 +1,149 @@
+"""
+Chokwadi AI - Semantic Cache
+Reuses a prior analysis for near-duplicate forwards of the same viral message.
+Text is normalised and compared as bag-of-words vectors (cosine similarity),
+so reworded copies with extra emoji or reordered lines still hit.
+"""
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from config import (
+    SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MIN_WORDS,
+    SEMANTIC_CACHE_TTL_SECONDS,
+)
+from core.log import log
+
+_URL_RE = re.compile(r'https?://\S+')
+_WORD_RE = re.compile(r"\w+")
+# "isn't", "don't", "won't", "can't" would otherwise split into "isn" + "t"
+# and slip past the negation check below
+_NT_RE = re.compile(r"n['’]t\b")
+
+# Normalising already scores extra emoji and reordered lines at 1.0, so a
+# lower score means words were swapped. One swapped word ("without" ->
+# "after", "3" -> "300", a different town) flips a claim while barely moving
+# the cosine, so a fuzzy hit may only differ by these filler words. Negations
+# and numbers are never filler.
+_FILLER = frozenset({
+    "a", "an", "the", "and", "so", "just", "very", "really", "this", "that",
+    "please", "pls", "plz", "kindly", "share", "forward", "forwarded", "fwd",
+    "urgent", "breaking", "news", "read", "hi", "hello", "ok", "okay", "amen",
+})
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop URLs, emoji and punctuation, spell out n't, collapse whitespace."""
+    text = _NT_RE.sub(" not", _URL_RE.sub(" ", text.lower()))
+    return " ".join(_WORD_RE.findall(text))
+
+
+def _vectorize(normalized: str) -> tuple[Counter, float]:
+    vec = Counter(normalized.split())
+    norm = math.sqrt(sum(n * n for n in vec.values()))
+    return vec, norm
+
+
+def _cosine(a: Counter, a_norm: float, b: Counter, b_norm: float) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(n * b[w] for w, n in a.items() if w in b)
+    return dot / (a_norm * b_norm)
+
+
+def _only_filler_differs(a: Counter, b: Counter) -> bool:
+    return a.keys() ^ b.keys() <= _FILLER
+
+
+def _digest(normalized: str) -> bytes:
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+
+class SemanticCache:
+    """
+    Bounded near-duplicate cache, evicting the least recently used entry.
+    Exact repeats (after normalising) are found by hash before the similarity scan;
+    a fuzzy hit must share every word apart from a few fillers.
+
+    Args:
+        maxsize:    Max analyses held per worker
+        threshold:  Minimum cosine similarity counted as a hit
+        min_words:  Shorter messages are too ambiguous to fuzzy-match
+        ttl:        Seconds an analysis stays reusable
+    """
+
+    def __init__(self, maxsize: int = 1000, threshold: float = 0.95,
+                 min_words: int = 8, ttl: int = 6 * 3600):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.min_words = min_words
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (content_type, digest) -> (expires, vec, norm, response)
+        self._lock = threading.Lock()
+
+    def get(self, content_type: str, text: str) -> str | None:
+        normalized = normalize(text)
+        exact_key = (content_type, _digest(normalized))
+        now = time.monotonic()
+
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(exact_key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(exact_key)
+                log.info("[SEMANTIC CACHE] Exact hit")
+                return entry[3]
+
+        vec, norm = _vectorize(normalized)
+        if sum(vec.values()) < self.min_words:
+            return None
+
+        best_key, best_score = None, self.threshold
+        with self._lock:
+            for key, (expires, other, other_norm, _) in self._entries.items():
+                if expires <= now or key[0] != content_type or not _only_filler_differs(vec, other):
+                    continue
+                score = _cosine(vec, norm, other, other_norm)
+                if score >= best_score:
+                    best_key, best_score = key, score
+                    if score >= 1.0:
+                        break
+
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            log.info("[SEMANTIC CACHE] Hit (%.3f)", best_score)
+            return self._entries[best_key][3]
+
+    def add(self, content_type: str, text: str, response: str):
+        normalized = normalize(text)
+        if not normalized:
+            return
+        vec, norm = _vectorize(normalized)
+        key = (content_type, _digest(normalized))
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vec, norm, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _expire(self, now: float):
+        # Drops stale entries from the LRU end; a stale entry moved forward by
+        # a hit is skipped on lookup and eventually evicted by size.
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[0] > now:
+                break
+            del self._entries[key]
+
+
+semantic_cache = SemanticCache(
+    maxsize=SEMANTIC_CACHE_MAX_ENTRIES,
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    min_words=SEMANTIC_CACHE_MIN_WORDS,
+    ttl=SEMANTIC_CACHE_TTL_SECONDS,
+)
@@ -3,11 +3,31 @@ Chokwadi AI - Voice Note Transcriber
 Converts WhatsApp voice notes to text using OpenAI Whisper API.
 Downloads audio from Meta's CDN using the WhatsApp access token.
 """
-import os
-import tempfile
+import atexit
+import io
 import httpx
 import openai
 from config import OPENAI_API_KEY, WHATSAPP_ACCESS_TOKEN
+from core.log import log
+
+# Built once per worker so metadata lookups, CDN downloads and Whisper
+# uploads reuse warm connections instead of a TLS handshake per voice note
+_HTTP = httpx.Client(
+    headers={"Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}"},
+    timeout=30,
+    follow_redirects=True,
+)
+atexit.register(_HTTP.close)
+
+_OPENAI = openai.OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+
+# (content-type substring, upload file extension), checked in order
+_CT_SUFFIXES = (
+    ("ogg", ".ogg"), ("opus", ".ogg"),
+    ("mp4", ".m4a"), ("m4a", ".m4a"),
+    ("mpeg", ".mp3"), ("mp3", ".mp3"),
+    ("amr", ".amr"),
+)
 
 
 def transcribe_voice_note(media_id: str) -> dict:
@@ -20,13 +40,14 @@ def transcribe_voice_note(media_id: str) -> dict:
     Returns:
         dict with keys: 'text' (transcription), 'language' (detected language)
     """
-    tmp_path = None
+    if _OPENAI is None:
+        return {"text": None, "language": None, "error": "OPENAI_API_KEY not configured"}
+
     try:
         # Step 1: Get the media URL from Meta
         media_url_endpoint = f"https://graph.facebook.com/v22.0/{media_id}"
-        headers = {"Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}"}
 
-        resp = httpx.get(media_url_endpoint, headers=headers, timeout=30)
+        resp = _HTTP.get(media_url_endpoint)
         resp.raise_for_status()
         media_info = resp.json()
         download_url = media_info.get("url")
@@ -34,26 +55,20 @@ def transcribe_voice_note(media_id: str) -> dict:
         if not download_url:
             return {"text": None, "language": None, "error": "No media URL returned"}
 
-        # Step 2: Download the actual audio file
-        audio_resp = httpx.get(download_url, headers=headers, follow_redirects=True, timeout=60)
-        audio_resp.raise_for_status()
-
-        # Determine file extension from content type
-        content_type = audio_resp.headers.get("content-type", "")
-        if "ogg" in content_type or "opus" in content_type:
-            suffix = ".ogg"
-        elif "mp4" in content_type or "m4a" in content_type:
-            suffix = ".m4a"
-        elif "mpeg" in content_type or "mp3" in content_type:
-            suffix = ".mp3"
-        elif "amr" in content_type:
-            suffix = ".amr"
-        else:
-            suffix = ".ogg"  # WhatsApp default
-
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-            tmp.write(audio_resp.content)
-            tmp_path = tmp.name
+        # Step 2: Stream the audio file straight into the upload buffer
+        audio_file = io.BytesIO()
+        with _HTTP.stream("GET", download_url, timeout=60) as audio_resp:
+            audio_resp.raise_for_status()
+            content_type = audio_resp.headers.get("content-type", "")
+            for chunk in audio_resp.iter_bytes(chunk_size=65536):
+                audio_file.write(chunk)
+        audio_file.seek(0)
+
+        # Determine file extension from content type (WhatsApp default: .ogg)
+        suffix = next((ext for needle, ext in _CT_SUFFIXES if needle in content_type), ".ogg")
+
+        # Upload straight from memory; the SDK infers the format from .name
+        audio_file.name = f"voice_note{suffix}"
 
         # Step 3: Transcribe with Whisper
         # The prompt parameter guides Whisper on expected language/vocabulary
@@ -68,15 +83,12 @@ def transcribe_voice_note(media_id: str) -> dict:
             "zvokwadi zvinobatsira, mhosva, nyaya, dambudziko."
         )
 
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-
-        with open(tmp_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="verbose_json",
-                prompt=shona_prompt,
-            )
+        transcription = _OPENAI.audio.transcriptions.create(
+            model="whisper-1",
+            file=audio_file,
+            response_format="verbose_json",
+            prompt=shona_prompt,
+        )
 
         return {
             "text": transcription.text,
@@ -84,12 +96,5 @@ def transcribe_voice_note(media_id: str) -> dict:
         }
 
     except Exception as e:
-        print(f"[ERROR] Transcription failed: {e}")
+        log.error("[ERROR] Transcription failed: %s", e)
         return {"text": None, "language": None, "error": str(e)}
-
-    finally:
-        if tmp_path:
-            try:
-                os.unlink(tmp_path)
-            except OSError:
-                pass
@@ -0,0 +1,11 @@
+"""
+Chokwadi AI - Gunicorn hooks
+Loaded via `-c gunicorn.conf.py` in the Procfile; server flags stay there.
+"""
+
+
+def worker_exit(server, worker):
+    # Webhooks are ACKed before processing and Meta won't redeliver them, so
+    # finish the worker's queue while its thread pools still accept work
+    from app import drain_work_queue
+    drain_work_queue()
@@ -173,3 +173,14 @@ Pay special attention to:
 
 Extracted text from image:
 """
+
+TEXT_CONTEXT = """Please analyse the following content for credibility and misinformation:
+"""
+
+LINK_CONTEXT = """Please analyse this URL/link for safety and credibility:
+"""
+
+CONFIDENCE_INSTRUCTION = """After your analysis, end your reply with one final line containing only
+a JSON object rating how confident you are in your assessment, from 0 to 1:
+{"confidence": <number from 0 to 1>}
+"""
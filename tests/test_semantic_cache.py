@@ -0,0 +1,58 @@
+import unittest
+
+from core.semantic_cache import SemanticCache, normalize
+
+FORWARD = (
+    "URGENT from the Ministry of Health: the new vaccine being given at clinics "
+    "in Harare and Bulawayo {} safe for children under five. Doctors at Parirenyatwa "
+    "confirmed this morning after the trial results were published. Share with every "
+    "parent you know before Monday so that families can make the right decision "
+    "for their children and grandchildren."
+)
+
+
+class NegationGuardTest(unittest.TestCase):
+    def test_contraction_is_spelled_out(self):
+        self.assertEqual(normalize("It isn't true"), "it is not true")
+        self.assertEqual(normalize("We DON’T know"), "we do not know")
+
+    def test_contracted_negation_does_not_reuse_opposite_verdict(self):
+        cache = SemanticCache(threshold=0.95, min_words=8)
+        cache.add("text", FORWARD.format("is"), "verdict: IS safe")
+
+        self.assertIsNone(cache.get("text", FORWARD.format("isn't")))
+        self.assertIsNone(cache.get("text", FORWARD.format("is not")))
+        self.assertEqual(cache.get("text", FORWARD.format("is") + " 🙏"), "verdict: IS safe")
+
+
+class SubstitutionGuardTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SemanticCache(threshold=0.95, min_words=8)
+
+    def _assert_no_reuse(self, original: str, edited: str):
+        self.cache.add("text", original, "verdict")
+        self.assertIsNone(self.cache.get("text", edited))
+
+    def test_changed_preposition_does_not_reuse_verdict(self):
+        claim = ("Health officials say it is fine to drink tap water {} boiling it first "
+                 "in all suburbs of Harare this week because the council has treated the supply.")
+        self._assert_no_reuse(claim.format("without"), claim.format("after"))
+
+    def test_changed_number_does_not_reuse_verdict(self):
+        claim = ("Breaking: {} deaths were confirmed at Parirenyatwa hospital after patients received "
+                 "the new vaccine this morning, according to a nurse who works on the ward.")
+        self._assert_no_reuse(claim.format("3"), claim.format("300"))
+
+    def test_changed_place_does_not_reuse_verdict(self):
+        claim = ("Police have announced a curfew from six in the evening across {} starting tonight, "
+                 "and anyone found on the streets will be arrested without warning.")
+        self._assert_no_reuse(claim.format("Bulawayo"), claim.format("Mutare"))
+
+    def test_added_filler_reuses_verdict(self):
+        self.cache.add("text", FORWARD.format("is"), "verdict: IS safe")
+        self.assertEqual(self.cache.get("text", "Please share! " + FORWARD.format("is")),
+                         "verdict: IS safe")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import app
+
+
+class DrainWorkQueueTest(unittest.TestCase):
+    def _enqueue(self, count: int, prefix: str):
+        for i in range(count):
+            app._enqueue_message({"id": f"{prefix}-{time.monotonic_ns()}-{i}"})
+
+    def test_drain_waits_for_queued_and_in_flight_messages(self):
+        handled = []
+        lock = threading.Lock()
+
+        def slow_process(message):
+            time.sleep(0.2)
+            # Handlers submit to the shared pools; they must still accept work
+            app._ACK_POOL.submit(lambda: None).result()
+            with lock:
+                handled.append(message["id"])
+
+        with mock.patch.object(app, "_process_message", slow_process):
+            self._enqueue(3, "drain")
+            self.assertTrue(app.drain_work_queue(timeout=5))
+
+        self.assertEqual(len(handled), 3)
+        self.assertEqual(app._pending, 0)
+
+    def test_drain_gives_up_after_timeout(self):
+        release = threading.Event()
+
+        with mock.patch.object(app, "_process_message", lambda message: release.wait(5)):
+            self._enqueue(1, "stuck")
+            self.assertFalse(app.drain_work_queue(timeout=0.1))
+            release.set()
+            self.assertTrue(app.drain_work_queue(timeout=5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,11 @@
+"""
+Chokwadi AI - WSGI Entry Point
+Patches blocking I/O for gevent before anything else is imported, so every
+httpx / SDK socket call made while handling a webhook yields to other
+greenlets instead of holding up the worker.
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+from app import app  # noqa: E402